@@ -4,114 +4,101 @@
 
 """Contains classes for representing lines."""
 
+from xml.sax.saxutils import quoteattr
+
+import numpy as np
 import pandas as pd
-import svgwrite
-import svgpathtools
 
 from . import shape_tools
 
+_ROUTE_COLUMNS = [
+    "route_id", "route_name", "route_type", "route_color", "route_text_color"
+]
+# The only columns rendering needs, so Lines stay cheap to send to workers
+_RENDER_COLUMNS = ["shape_id", "direction_id", "x", "y"]
+
 class Line:
 
     """Represents a line."""
 
-    shape_df: pd.DataFrame = None
+    __slots__ = (
+        "shape_df", "route_id", "route_name", "route_type", "route_color",
+        "route_text_color", "shape_ids", "_direction_bounds",
+    )
 
     line_width: float = 1
     opacity: float = 1
     offset_curves = False
 
-    route_id: str = None
-    route_name: str = None
-    route_type: str = None
-    route_color: str = None
-    route_text_color: str = None
-    shape_id: str = None
-
-    drawing: svgwrite.Drawing = None
-
     def __init__(self, shape_df: pd.DataFrame):
-        self.shape_df = shape_df
-        self.route_id = shape_df["route_id"].iloc[0]
-        self.route_name = shape_df["route_name"].iloc[0]
-        self.route_type = shape_df["route_type"].iloc[0]
-        self.route_color = f"#{shape_df["route_color"].iloc[0]}"
-        self.route_text_color = f"#{shape_df["route_text_color"].iloc[0]}"
+        self.shape_df = shape_df.sort_values(
+            ["direction_id", "shape_id", "shape_pt_sequence"], kind="stable"
+        )[_RENDER_COLUMNS].reset_index(drop=True)
+        # Row offsets where directions 0 and 1 start and end in shape_df
+        self._direction_bounds = np.searchsorted(
+            self.shape_df["direction_id"].to_numpy(), [0, 1, 2]
+        )
+        first = {column: shape_df[column].iat[0] for column in _ROUTE_COLUMNS}
+        self.route_id = first["route_id"]
+        self.route_name = first["route_name"]
+        self.route_type = int(first["route_type"])
+        self.route_color = f"#{first['route_color']}"
+        self.route_text_color = f"#{first['route_text_color']}"
         self.shape_ids = shape_df["shape_id"].unique()
 
-    def render_route(self, dwg: svgwrite.Drawing, map_bounds: tuple):
-        """Renders the line on a drawing."""
-        if dwg is None:
-            self.drawing = dwg
-        route_group = self.group(dwg, id=self.route_id)
-        self.render_direction(0, route_group, map_bounds)
-        self.render_direction(1, route_group, map_bounds)
-
-    def render_direction(
-            self, direction, dwg: svgwrite.Drawing, map_bounds: tuple
-    ):
-        """Renders the line's direction on a drawing."""
-        shape = self.shape_df[self.shape_df.direction_id == direction]
-        group = dwg.add(self.group(dwg, id=f"{self.route_id}-{direction}"))
-        # for shape_id in shape.shape_id.unique():
-        shape = shape.copy()
-        shape.sort_values("shape_pt_sequence", inplace=True)
-        # this_shape = self.shape_df[self.shape_df.shape_id == shape_id]
-        self.render_shapes(direction, group, map_bounds, shape)
+    def render_fragment(self, map_bounds: tuple) -> str:
+        """Renders the line as a standalone SVG group string."""
+        directions = "".join(
+            self.render_direction(direction, map_bounds) for direction in (0, 1)
+        )
+        return self.group(self.route_id, directions)
+
+    def render_direction(self, direction, map_bounds: tuple) -> str:
+        """Renders the line's direction as an SVG group string."""
+        start, stop = self._direction_bounds[direction:direction + 2]
+        shape = self.shape_df.iloc[start:stop]
+        polylines = "".join(
+            self.render_shapes(direction, map_bounds, this_shape)
+            for _, this_shape in shape.groupby("shape_id", sort=False)
+        )
+        return self.group(f"{self.route_id}-{direction}", polylines)
     
     def render_shapes(
-            self, direction, dwg: svgwrite.Drawing, map_bounds: tuple,
-            shape: pd.DataFrame
-    ):
-        points = shape[["x", "y"]].values.tolist()
+            self, direction, map_bounds: tuple, shape: pd.DataFrame
+    ) -> str:
         # Shift points by the minimum x and y values
-        points = [
-            (point[0] - map_bounds[0], point[1] - map_bounds[2])
-            for point in points
-        ]
-        line = self.process_line(dwg, points, direction)
-        if line.points != []:
-            dwg.add(line)
-
-    def process_line(self, dwg, points, direction=None):
-        # Create a list of Line objects connecting the points
-        lines = [
-            svgpathtools.Line(start=complex(x1, y1), end=complex(x2, y2))
-            for (x1, y1), (x2, y2) in zip(points[:-1], points[1:])
-        ]
-
-        # Create a Path object from the lines
-        path = svgpathtools.Path(*lines)
-
-        # Offset the path basedon the direction
-        path = self.offset_curve_wrapper(path, direction)
-
-        points = [
-            (float(segment.start.real), float(segment.start.imag))
-            for segment in path
-        ]
-        # Convert the path to an svgwrite.shapes.Path object
-        line = self.drawing.polyline(
-            points=points, 
-            stroke=self.route_color,
-            stroke_width=self.line_width,
-            fill="none",
+        points = shape[["x", "y"]].to_numpy(copy=True)
+        points -= np.array([map_bounds[0], map_bounds[2]], dtype=points.dtype)
+        points = shape_tools.drop_duplicate_points(points)
+        return self.process_line(points, direction)
+
+    def process_line(self, points: np.ndarray, direction=None) -> str:
+        # Offset and format the points based on the direction
+        points = self.offset_curve_wrapper(points, direction)
+        if not points:
+            return ""
+        # Drop the formatted points straight into a polyline element
+        return (
+            f'<polyline fill="none" points="{points}" '
+            f'stroke={quoteattr(self.route_color)} '
+            f'stroke-width="{self.line_width}" />'
         )
-        return line
 
-    def offset_curve_wrapper(self, path, direction):
-        """Wraps the offset_curve function."""
+    def offset_curve_wrapper(self, points: np.ndarray, direction) -> str:
+        """Wraps the emit_offset_polyline function."""
         if not self.offset_curves:
-            return path
-        path = shape_tools.offset_curve(path, -self.line_width)
-        return path
+            if len(points) < 2:
+                return ""
+            return shape_tools.format_points(points)
+        return shape_tools.emit_offset_polyline(points, -self.line_width)
 
     ############################################################################
     # Helper functions                                                         #
     ############################################################################
 
-    def group(self, add_to: svgwrite.Drawing, id: str):
-        """Adds a group to a drawing."""
-        return add_to.add(self.drawing.g(id=id))
+    def group(self, id: str, content: str) -> str:
+        """Wraps SVG content in a group."""
+        return f'<g id={quoteattr(str(id))}>{content}</g>'
     
     ############################################################################
     # Dunders                                                                  #
@@ -127,6 +114,8 @@ class LightRail(Line):
 
     """Represents a light rail line."""
 
+    __slots__ = ()
+
     line_width = 0.35
     opacity = 0.5
     offset_curves = True
@@ -135,6 +124,8 @@ class Subway(Line):
     
     """Represents a subway line."""
 
+    __slots__ = ()
+
     line_width = 0.5
     opacity = 0.7
     offset_curves = True
@@ -143,6 +134,8 @@ class Rail(Line):
 
     """Represents a rail line."""
 
+    __slots__ = ()
+
     line_width = 0.5
     opacity = 0.5
 
@@ -150,6 +143,8 @@ class Bus(Line):
 
     """Represents a bus line."""
 
+    __slots__ = ()
+
     line_width = 0.1
     opacity = 0.2
 
@@ -157,6 +152,8 @@ class Ferry(Line):
 
     """Represents a ferry line."""
 
+    __slots__ = ()
+
     line_width = 0.25
     opacity = 0.3
 
@@ -164,6 +161,8 @@ class CableCar(Line):
     
     """Represents a cable car line."""
 
+    __slots__ = ()
+
     line_width = 0.25
     opacity = 0.5
 
@@ -171,6 +170,8 @@ class Gondola(Line):
 
     """Represents a gondola line."""
 
+    __slots__ = ()
+
     line_width = 0.25
     opacity = 0.3
 
@@ -178,6 +179,8 @@ class Funicular(Line):
     
     """Represents a funicular line."""
     
+    __slots__ = ()
+
     line_width = 0.25
     opacity = 0.3
 
@@ -185,6 +188,8 @@ class TrolleyBus(Line):
 
     """Represents a trolleybus line."""
 
+    __slots__ = ()
+
     line_width = 0.15
     opacity = 0.2
 
@@ -192,6 +197,8 @@ class Monorail(Line):
 
     """Represents a monorail line."""
 
+    __slots__ = ()
+
     line_width = 0.4
     opacity = 0.5
 
@@ -208,6 +215,9 @@ _LINE_TYPES = {
     12: Monorail
 }
 
+# Indexed directly by route_type; gaps in the GTFS route types are None
+_LINE_TYPES_TUPLE = tuple(_LINE_TYPES.get(i) for i in range(13))
+
 _MODE_NAMES = {
     0: "Light Rail",
     1: "Subway",
@@ -239,4 +249,11 @@ _MODE_PRIORITY = [3, 5, 11, 6, 7, 4, 12, 2, 0, 1]
 
 def make_line(shape_df: pd.DataFrame) -> Line:
     """Makes a line from a shape dataframe."""
-    return _LINE_TYPES[shape_df["route_type"].iloc[0]](shape_df)
\ No newline at end of file
+    route_type = int(shape_df["route_type"].iat[0])
+    if 0 <= route_type < len(_LINE_TYPES_TUPLE):
+        line_type = _LINE_TYPES_TUPLE[route_type]
+    else:
+        line_type = None
+    if line_type is None:
+        raise ValueError(f"Unsupported route_type: {route_type}")
+    return line_type(shape_df)
\ No newline at end of file
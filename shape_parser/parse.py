@@ -6,9 +6,14 @@
 Parses shapes from a shape SVG file and returns a list of shapes.
 """
 
+import math
+import os
 import pathlib
+from concurrent.futures import Executor, ProcessPoolExecutor
+from contextlib import nullcontext
+from itertools import repeat
 
-import svgwrite
+import numpy as np
 import pandas as pd
 
 from . import line
@@ -17,9 +22,32 @@ from . import line
 _SHAPE_FILE = pathlib.Path("./shape_parser/shapes.txt")
 _ROUTE_FILE = pathlib.Path("./shape_parser/shapes_by_route.csv")
 _OUTPUT_FILE = pathlib.Path("./shape_parser/shapes.svg")
+_CACHE_SUFFIX = ".parquet"
+# Rendering a route takes a few ms, so only fan out when there is enough work
+_PARALLEL_MIN_ROUTES = 64
+_PARALLEL_CHUNKSIZE = 8
+_SVG_HEADER = (
+    '<?xml version="1.0" encoding="utf-8" ?>\n'
+    '<svg baseProfile="full" height="{height}px" version="1.1" '
+    'width="{width}px" xmlns="http://www.w3.org/2000/svg" '
+    'xmlns:ev="http://www.w3.org/2001/xml-events" '
+    'xmlns:xlink="http://www.w3.org/1999/xlink"><defs />'
+)
 
 _BOSTON_ORIGIN = (42.3601, -71.0589)
 _LAT_LONG_SCALE = 1000
+# Points are rounded to thousandths of a pixel, so single precision is enough
+_COORDINATE_DTYPE = np.float32
+# Identifiers are read as strings so mixed ids ("1", "Red") share one type
+_CSV_DTYPES = {
+    "shape_id": str,
+    "route_id": str,
+    "route_name": str,
+    "route_color": str,
+    "route_text_color": str,
+    "x": _COORDINATE_DTYPE,
+    "y": _COORDINATE_DTYPE,
+}
 
 class MapMaker:
 
@@ -32,8 +60,6 @@ class MapMaker:
 
     map_bounds = None
 
-    drawing: svgwrite.Drawing = None
-
     def __init__(
             self, shape_file=_SHAPE_FILE, route_file=_ROUTE_FILE,
             force_reanalysis=False
@@ -52,55 +78,57 @@ class MapMaker:
         """Loads shapes from a shape file and adds them to the shapes list."""
         self._print("Loading shapes")
         self.routes = []
-        df = pd.read_csv(self.shape_file)
-        self.analyze(df)
-        for route_id in df.route_id.unique():
+        df = self._read_cache()
+        if df is None:
+            df = pd.read_csv(self.shape_file, dtype=_CSV_DTYPES)
+            df = self.analyze(df)
+        else:
+            self.get_map_bounds(df)
+        for route_id, points in df.groupby("route_id", sort=False):
             self._print(f"Loading shape {route_id}", 3)
-            points = df[df.route_id == route_id]
             shape_line = line.make_line(points)
             self.routes.append(shape_line)
 
     def analyze(self, df: pd.DataFrame, save=True):
         """Analyzes the shapes dataframe."""
-        self.add_route_data(df, save=True)
+        df = self.add_route_data(df, save=True)
         self.convert_lat_long_to_points(df, save=True)
         self.get_map_bounds(df)
+        if save:
+            self._write_cache(df)
+        return df
     
     def get_map_bounds(self, df: pd.DataFrame):
-        self.map_bounds = []
-        absolute_max_x = abs(df.x).max()
-        absolute_max_y = abs(df.y).max()
+        x = df["x"].to_numpy()
+        y = df["y"].to_numpy()
+        # Round outwards to the output precision so no point falls outside
+        absolute_max_x = math.ceil(float(max(x.max(), -x.min())) * 1000) / 1000
+        absolute_max_y = math.ceil(float(max(y.max(), -y.min())) * 1000) / 1000
         self.map_bounds = [
             -absolute_max_x, absolute_max_x, -absolute_max_y, absolute_max_y
         ]
     
-    def add_route_data(self, df: pd.DataFrame, save=True):
+    def add_route_data(self, df: pd.DataFrame, save=True) -> pd.DataFrame:
         """Adds route data to the shapes dataframe based on the shape_id."""
         self._print("Adding route data")
-        routes = pd.read_csv(self.route_file)
+        routes = pd.read_csv(self.route_file, dtype=_CSV_DTYPES)
         routes.columns = [i.lower() for i in routes.columns]
         # Check if route columns are in the df, if so, return
         if self._check_df_for_columns(df, routes):
-            return
+            return df
         # Re-index the dataframe
-        routes = routes.loc[~routes.shape_id.duplicated()]
-        # Remove shape_ids that are not in the routes dataframe
-        df = df[df.shape_id.isin(routes.shape_id)]
+        routes = routes.drop_duplicates("shape_id").set_index("shape_id")
         # Remove duplicate columns
-        routes = routes.set_index("shape_id")
-        columns = routes.columns
-        # Convert routes to a dictionary
-        routes = routes.to_dict(orient="index")
-        for column in columns:
-            self._print(f"Adding {column} to shapes dataframe", 2)
-            if column == "shape_id":
-                continue
-            df[column] = [
-                routes[shape_id][column] for shape_id in df.shape_id
-            ]
+        df = df.drop(columns=routes.columns, errors="ignore")
+        # Add every route column in a single join on shape_id, dropping
+        # shape_ids that are not in the routes dataframe
+        columns = ", ".join(routes.columns)
+        self._print(f"Adding {columns} to shapes dataframe", 2)
+        df = df.join(routes, on="shape_id", how="inner")
         # Save the dataframe
         if save:
             df.to_csv(self.shape_file, index=False)
+        return df
 
     def convert_lat_long_to_points(self, df: pd.DataFrame, save=True):
         """Converts lat and long to x and y coordinates."""
@@ -109,12 +137,12 @@ class MapMaker:
         if self._check_df_for_columns(df, pd.DataFrame({"x": [], "y": []})):
             return
         # Convert lat and long to x and y
-        df["x"], df["y"] = zip(*df.apply(
-            lambda row: self._lat_long_to_xy(
-                row["shape_pt_lat"], 
-                row["shape_pt_lon"]),
-            axis=1
-        ))
+        df["x"] = (
+            (df["shape_pt_lon"] - _BOSTON_ORIGIN[1]) * _LAT_LONG_SCALE
+        ).astype(_COORDINATE_DTYPE)
+        df["y"] = (
+            -(df["shape_pt_lat"] - _BOSTON_ORIGIN[0]) * _LAT_LONG_SCALE
+        ).astype(_COORDINATE_DTYPE)
         # Save the dataframe
         if save:
             df.to_csv(self.shape_file, index=False)
@@ -130,6 +158,46 @@ class MapMaker:
             return True
         return False
 
+    def _cache_file(self) -> pathlib.Path:
+        """Returns the path of the analyzed shapes cache."""
+        return pathlib.Path(self.shape_file).with_suffix(_CACHE_SUFFIX)
+
+    def _read_cache(self) -> pd.DataFrame:
+        """Reads the analyzed shapes from the cache if it is up to date."""
+        cache_file = self._cache_file()
+        if self.force or not cache_file.exists():
+            return None
+        sources = [pathlib.Path(self.shape_file), pathlib.Path(self.route_file)]
+        if any(i.stat().st_mtime > cache_file.stat().st_mtime for i in sources):
+            self._print("Shape cache is stale", 2)
+            return None
+        try:
+            df = pd.read_parquet(cache_file, engine="pyarrow")
+        except ImportError:
+            return None
+        except (OSError, ValueError):
+            # pyarrow's ArrowInvalid is a ValueError
+            self._print("Shape cache is unreadable", 2)
+            return None
+        self._print("Loaded shapes from cache :)", 2)
+        return df
+
+    def _write_cache(self, df: pd.DataFrame):
+        """Writes the analyzed shapes to the cache."""
+        cache_file = self._cache_file()
+        # Write beside the cache and swap it in, so readers never see a
+        # partially written file
+        temp_file = cache_file.with_name(cache_file.name + ".tmp")
+        try:
+            df.to_parquet(temp_file, engine="pyarrow", index=False)
+        except ImportError:
+            self._print("pyarrow is not installed, not caching shapes", 2)
+            return
+        except BaseException:
+            temp_file.unlink(missing_ok=True)
+            raise
+        temp_file.replace(cache_file)
+
     def _lat_long_to_xy(self, lat, long):
         """Converts lat and long to x and y coordinates."""
         x = (long - _BOSTON_ORIGIN[1]) * _LAT_LONG_SCALE
@@ -139,42 +207,56 @@ class MapMaker:
     def make_svg(self, output_file=_OUTPUT_FILE):
         """Makes an SVG file from the shapes."""
         self._print("Making SVG")
-        svgwrite.AUTHOR_EMAIL = "zpogrebin111@gmail.com"
-        svgwrite.AUTHOR_NAME = "Zev Pogrebin"
-        self.drawing: svgwrite.Drawing = svgwrite.Drawing(
-            str(output_file), 
-            size=(
-                f"{self.map_bounds[1] - self.map_bounds[0]}px", 
-                f"{self.map_bounds[3] - self.map_bounds[2]}px"
-            )
+        header = _SVG_HEADER.format(
+            width=self.map_bounds[1] - self.map_bounds[0],
+            height=self.map_bounds[3] - self.map_bounds[2],
         )
-        self.render_routes(self.drawing)
-        self.drawing.save()
+        # Stream the document to disk one route fragment at a time
+        with open(output_file, "w", encoding="utf-8") as svg_file:
+            svg_file.write(header)
+            self.render_routes(svg_file)
+            svg_file.write("</svg>")
     
-    def render_routes(self, draw_on):
-        """Renders routes on a drawing."""
+    def render_routes(self, svg_file):
+        """Renders routes to an open SVG file."""
         # Make a group for the routes
-        routes_group = draw_on.add(self.drawing.g(id="routes"))
-        for mode in line._MODE_PRIORITY:
-            mode_name = line._MODE_NAMES[mode]
-            self._print(f"Rendering mode {mode_name}", 2)
-            routes = [i for i in self.routes if i.route_type == mode]
-            self.render_mode(routes, routes_group, line.Line.render_route)   
+        svg_file.write('<g id="routes">')
+        with self._make_executor() as executor:
+            for mode in line._MODE_PRIORITY:
+                mode_name = line._MODE_NAMES[mode]
+                self._print(f"Rendering mode {mode_name}", 2)
+                routes = [i for i in self.routes if i.route_type == mode]
+                self.render_mode(
+                    routes, svg_file, line.Line.render_fragment, executor
+                )
+        svg_file.write("</g>")
+
+    def _make_executor(self):
+        """Returns a process pool, or a null context if rendering serially."""
+        cpu_count = os.cpu_count() or 1
+        if cpu_count == 1 or len(self.routes) < _PARALLEL_MIN_ROUTES:
+            return nullcontext()
+        return ProcessPoolExecutor()
 
     def render_mode(
-            self, routes: list[line.Line], dwg: svgwrite.Drawing,
-            mode_function: callable
+            self, routes: list[line.Line], svg_file,
+            mode_function: callable, executor: Executor = None
     ):
-        """Renders a mode on a drawing"""
+        """Renders a mode's routes, in parallel if given an executor."""
         # Create a group for the mode with the mode name
         if len(routes) == 0:
             return
         mode = routes[0].route_type
-        mode_group = dwg.add(
-            self.drawing.g(id=mode, opacity=line._LINE_OPACITIES[mode]),
-        )
-        for shape in routes:
-            shape: line.Line
-            shape.drawing = self.drawing
-            mode_function(shape, mode_group, map_bounds=self.map_bounds)
-            self._print(f"Rendered shape {shape}", 3)
\ No newline at end of file
+        opacity = line._LINE_OPACITIES[mode]
+        svg_file.write(f'<g id="{mode}" opacity="{opacity}">')
+        if executor is None:
+            fragments = map(mode_function, routes, repeat(self.map_bounds))
+        else:
+            fragments = executor.map(
+                mode_function, routes, repeat(self.map_bounds),
+                chunksize=_PARALLEL_CHUNKSIZE,
+            )
+        for shape, fragment in zip(routes, fragments):
+            svg_file.write(fragment)
+            self._print(f"Rendered shape {shape}", 3)
+        svg_file.write("</g>")
@@ -2,35 +2,51 @@
 # @Author: Zev Pogrebin
 # 2023
 
-import svgpathtools
-import svgwrite
+import numpy as np
 
-def offset_curve(path: svgpathtools.Path, offset_distance: int, steps=10):
+def drop_duplicate_points(points: np.ndarray) -> np.ndarray:
     """
-    Takes in a Path object, `path`, and a distance,
-    `offset_distance`, and outputs an piecewise-linear approximation 
-    of the 'parallel' offset curve.
+    Drops points from the `(N, 2)` array `points` that repeat the point
+    before them, since they add nothing to the rendered polyline.
+    """
+    keep = np.ones(len(points), dtype=bool)
+    keep[1:] = np.any(np.diff(points, axis=0) != 0, axis=1)
+    return points[keep]
 
-    From 
-    [readme.md](https://github.com/mathandy/svgpathtools/tree/master)
-    """
-    nls = []
-    for seg in path:
-        ct = 1
-        for k in range(steps):
-            t = k / steps
-            if seg.start == seg.end:
-                continue
-            offset_vector = offset_distance * seg.normal(t)
-            nl = svgpathtools.Line(
-                seg.point(t), seg.point(t) + offset_vector
-            )
-            nls.append(nl)
-    connect_the_dots = [
-        svgpathtools.Line(nls[k].end, nls[k+1].end)
-        for k in range(len(nls)-1)
-    ]
-    if path.isclosed():
-        connect_the_dots.append(svgpathtools.Line(nls[-1].end, nls[0].end))
-    offset_path = svgpathtools.Path(*connect_the_dots)
-    return offset_path
\ No newline at end of file
+def offset_polyline(points: np.ndarray, distance: float) -> np.ndarray:
+    """
+    Offsets the polyline through the `(N, 2)` array `points` by `distance`
+    along each segment's unit normal `(dy, -dx)`, the convention
+    `svgpathtools.Line.normal` uses. Returns the `(2M, 2)` array of offset
+    segment endpoints for the `M` non-degenerate segments.
+    """
+    deltas = np.diff(points, axis=0)
+    lengths = np.hypot(deltas[:, 0], deltas[:, 1])
+    keep = lengths > 0
+    deltas = deltas[keep]
+    scale = distance / lengths[keep]
+    # Write both endpoints of every segment into one buffer, then shift
+    # them by the segment's offset vector in place
+    segments = np.empty((len(deltas), 2, 2), dtype=points.dtype)
+    segments[:, 0] = points[:-1][keep]
+    segments[:, 1] = points[1:][keep]
+    segments[:, :, 0] += (deltas[:, 1] * scale)[:, None]
+    segments[:, :, 1] -= (deltas[:, 0] * scale)[:, None]
+    return segments.reshape(-1, 2)
+
+def format_points(points: np.ndarray, fmt: str = "%.3f,%.3f") -> str:
+    """
+    Formats the `(N, 2)` array `points` as an SVG `points` attribute
+    (`"x1,y1 x2,y2 ..."`) with a single string-formatting pass.
+    """
+    return " ".join([fmt] * len(points)) % tuple(points.ravel().tolist())
+
+def emit_offset_polyline(
+        points: np.ndarray, distance: float, fmt: str = "%.3f,%.3f"
+) -> str:
+    """
+    Offsets the polyline through the `(N, 2)` array `points` by `distance`
+    and returns the offset points already formatted as an SVG `points`
+    attribute, without building any intermediate path objects.
+    """
+    return format_points(offset_polyline(points, distance), fmt)